@@ -50,3 +50,37 @@ small_patch_of_Helsinki = (24.904289,60.178148,24.957504,60.194364)
 bbox = small_patch_of_Helsinki
 
 max_bad_landing_proportion = 0.15
+
+# Simplification tolerances in meters for the precomputed levels of detail of the bad landing polygons
+bad_landing_lod_tolerances = (1, 5, 25)
+# The level of detail used against a KDE is the coarsest one with tolerance
+# at most this fraction of the KDE's size (square root of its area)
+bad_landing_lod_tolerance_to_kde_size = 0.002
+
+# Highest density regions of the landing site KDE, as proportions of the distribution.
+# The outermost one is the main result.
+kde_proportions_of_distribution = (0.5, 0.8, 0.95)
+
+# How the proportion of bad landing in the KDE is computed. 'exact' intersects the
+# bad landing polygons with the KDE, 'monte_carlo' classifies points sampled uniformly in it.
+bad_landing_proportion_mode = 'exact'
+# Also estimate the probability of a bad landing, by sampling from the fitted density.
+# A separate metric from the proportion of bad landing area, not to be compared
+# with max_bad_landing_proportion.
+estimate_bad_landing_probability = False
+# Standard error of at most 0.5 percentage points
+monte_carlo_sample_count = 10_000
+# Compute the proportion exactly when the estimate is this many standard errors or closer to max_bad_landing_proportion
+monte_carlo_fallback_standard_errors = 2
+
+# Concurrent launch times in the multi-site sweep. Overlaps forecast downloads,
+# the simulations themselves are CPU-bound.
+sweep_max_workers = 2
+
+# Budget for `python -X importtime -c "import find_launch_time.logic.find_time"`,
+# see import_time.py
+import_time_budget_seconds = 1.5
+# Heavy modules which must only be imported on first use
+# Must not be imported before the simulator's gevent patching, see find_time.load_simulator
+imported_after_simulator_modules = ('ssl', 'urllib3', 'requests')
+lazily_imported_modules = ('astra', 'gevent', 'eventlet', 'geoplot', 'seaborn', 'matplotlib', 'pyrosm', 'scipy', 'contourpy')
@@ -1,42 +1,79 @@
-# Imports gevent, which does monkey patching. Import this first to avoid
-# troubles with other imports.
-import dataclasses
-from astra.simulator import flight, forecastEnvironment
+from __future__ import annotations
 
+import dataclasses
 import json
 import logging
 import os
 import tempfile
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from pprint import pformat, pprint
+from typing import TYPE_CHECKING
 
 os.environ['USE_PYGEOS'] = '0'
 
 import geopandas as gpd
-import requests
-from requests.adapters import HTTPAdapter, Retry
 
+from .config import sweep_max_workers
 from .load_data import DataLoader
 from .proportion_of_kde import EnhancedEnsembleOutputs, get_enhanced_ensemble_outputs
 
+if TYPE_CHECKING:
+    import requests
+
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
+def make_session() -> requests.Session:
+    # Imports ssl, see load_simulator
+    import requests
+    from requests.adapters import HTTPAdapter, Retry
+
+    session = requests.Session()
+    retries = Retry(total=5, backoff_factor=0.1, status_forcelist=[500, 502, 503, 504])
+    session.mount('http://', HTTPAdapter(max_retries=retries))
+    session.mount('https://', HTTPAdapter(max_retries=retries))
+    return session
+
+
+def get_launch_site_elevation(latitude: float, longitude: float, session: requests.Session) -> float:
+    elevation_dataset = "FABDEM"
+    elevation_url = (
+        f"https://api.elevationapi.com/api/Elevation?lat={latitude}&lon={longitude}&dataSet={elevation_dataset}"
+    )
+    response = session.get(elevation_url)
+    return response.json()["geoPoints"][0]["elevation"]
+
+
+def load_simulator():
+    """Import the ASTRA simulator.
+
+    Importing it imports gevent, which does monkey patching, ssl included. gevent
+    must patch ssl before anything else imports it, or urllib3 keeps the unpatched
+    SSLContext, which leads to recursion errors in its setters. So this must run
+    before ssl, urllib3 or requests are imported. That is why requests is only
+    imported on first use in this package, and import_time.py checks that importing
+    it leaves ssl and urllib3 unimported. FindTime calls this first thing in
+    __init__, on the main thread. Deferred from module import time to keep importing
+    this module cheap.
+    """
+    from astra import simulator
+    return simulator
+
+
 def make_launch_params(
     latitude: float,
     longitude: float,
     launch_time: datetime,
     session: requests.Session,
+    elevation: float | None = None,
 ):
-    elevation_dataset = "FABDEM"
-    elevation_url = (
-        f"https://api.elevationapi.com/api/Elevation?lat={latitude}&lon={longitude}&dataSet={elevation_dataset}"
-    )
-    response = session.get(elevation_url)
-    elevation = response.json()["geoPoints"][0]["elevation"]
+    if elevation is None:
+        elevation = get_launch_site_elevation(latitude, longitude, session)
     return {
         "launchSiteLat": latitude,
         "launchSiteLon": longitude,
@@ -101,6 +138,27 @@ class LaunchInputs:
     parachute: str
 
 
+@dataclasses.dataclass
+class SiteEnhancedEnsembleOutputs:
+    """Outputs for one launch time at one of the launch sites of a multi-site sweep."""
+    site: str
+    outputs: EnhancedEnsembleOutputs
+
+
+def get_launch_times(
+    launch_time_min: datetime,
+    prediction_window_length: timedelta,
+    launch_time_increment: timedelta,
+) -> list[datetime]:
+    launch_time_max = launch_time_min + prediction_window_length
+    launch_times = []
+    launch_time = launch_time_min
+    while launch_time <= launch_time_max:
+        launch_times.append(launch_time)
+        launch_time = launch_time + launch_time_increment
+    return launch_times
+
+
 def run_sims(
     launch_time: datetime,
     launch_inputs: LaunchInputs,
@@ -108,9 +166,10 @@ def run_sims(
     output_path: Path,
     debug: bool,
     session: requests.Session,
+    elevation: float | None = None,
 ):
     output_formats = ('json',)
-    launch_params = make_launch_params(*launch_inputs.launch_coords_WGS84, launch_time, session)
+    launch_params = make_launch_params(*launch_inputs.launch_coords_WGS84, launch_time, session, elevation)
     flight_params = make_flight_params(
         balloon=launch_inputs.balloon,
         nozzle_lift_kg=launch_inputs.nozzle_lift_kg,
@@ -124,8 +183,9 @@ def run_sims(
     )
     print(f"launch params: {pformat(launch_params)}")
     print(f"flight params: {pformat(flight_params)}")
-    sim_environment = forecastEnvironment(**launch_params)
-    the_flight = flight(
+    simulator = load_simulator()
+    sim_environment = simulator.forecastEnvironment(**launch_params)
+    the_flight = simulator.flight(
         **flight_params,
         environment=sim_environment,
     )
@@ -136,14 +196,41 @@ def run_sims(
 
 class FindTime:
     def __init__(self, debug: bool = False):
+        # Before anything imports ssl, see load_simulator
+        load_simulator()
         self.debug = debug
         self.data_loader = DataLoader(debug=debug)
         if debug:
             logger.setLevel(logging.DEBUG)
-        self.reqsession = requests.Session()
-        retries = Retry(total=5, backoff_factor=0.1, status_forcelist=[500, 502, 503, 504])
-        self.reqsession.mount('http://', HTTPAdapter(max_retries=retries))
-        self.reqsession.mount('https://', HTTPAdapter(max_retries=retries))
+        self.reqsession = make_session()
+
+    def get_launch_time_outputs(
+        self,
+        launch_time: datetime,
+        launch_inputs: LaunchInputs,
+        sims_per_launch_time: int,
+        elevation: float | None = None,
+    ) -> EnhancedEnsembleOutputs:
+        """Simulate the flights for one launch time and analyse the landing sites."""
+        output_path = make_output_path()
+        predicted_landing_sites = run_sims(
+            launch_time,
+            launch_inputs,
+            sims_per_launch_time,
+            output_path,
+            self.debug,
+            self.reqsession,
+            elevation,
+        )
+        enhanced_outputs = get_enhanced_ensemble_outputs(
+            launch_time=launch_time,
+            points_gdf=predicted_landing_sites,
+            data_loader=self.data_loader,
+        )
+        for level in enhanced_outputs.levels:
+            print(f"proportion of bad landing area in {level.proportion_of_distribution:.0%} region: "
+                  f"{level.proportion_of_bad_landing_to_kde}")
+        return enhanced_outputs
 
     def get_prediction_geometries(
         self,
@@ -154,27 +241,55 @@ class FindTime:
         sims_per_launch_time: int=2,
     ):
         """Get the geometries of the predicted landing sites for the next 10 days."""
-        launch_time_max = launch_time_min + prediction_window_length
-        launch_time = launch_time_min
-        while launch_time <= launch_time_max:
-            output_path = make_output_path()
-            run_sims(
-                launch_time,
-                launch_inputs,
-                sims_per_launch_time,
-                output_path,
-                self.debug,
-                self.reqsession
-            )
-            predicted_landing_sites = get_predicted_landing_sites(output_path / "out.json")
-            enhanced_outputs = get_enhanced_ensemble_outputs(
-                launch_time=launch_time,
-                points_gdf=predicted_landing_sites,
-                data_loader=self.data_loader,
-            )
-            print(f"proportion of bad landing area: {enhanced_outputs.proportion_of_bad_landing_to_kde}")
-            yield enhanced_outputs
-            launch_time = launch_time + launch_time_increment
+        launch_times = get_launch_times(launch_time_min, prediction_window_length, launch_time_increment)
+        elevation = get_launch_site_elevation(*launch_inputs.launch_coords_WGS84, self.reqsession)
+        for launch_time in launch_times:
+            yield self.get_launch_time_outputs(launch_time, launch_inputs, sims_per_launch_time, elevation)
+
+    def get_prediction_geometries_for_sites(
+        self,
+        launch_inputs_by_site: dict[str, LaunchInputs],
+        prediction_window_length: timedelta,
+        launch_time_increment: timedelta,
+        launch_time_min: datetime | None = None,
+        sims_per_launch_time: int = 2,
+        max_workers: int = sweep_max_workers,
+    ) -> Iterator[SiteEnhancedEnsembleOutputs]:
+        """Sweep the same launch times at several launch sites at once.
+
+        Every site and launch time pair is scheduled on a small pool of workers, so that the
+        simulations' forecast downloads overlap. Each simulation still downloads its own forecast.
+        Each site's elevation is looked up once, up front, and the workers never use the HTTP
+        session. Results are yielded as they complete, labelled by site.
+        """
+        # Patch on the main thread before any worker runs, see load_simulator
+        load_simulator()
+        if launch_time_min is None:
+            launch_time_min = datetime.now(timezone.utc)
+        launch_times = get_launch_times(launch_time_min, prediction_window_length, launch_time_increment)
+        elevation_by_site = {
+            site: get_launch_site_elevation(*launch_inputs.launch_coords_WGS84, self.reqsession)
+            for site, launch_inputs in launch_inputs_by_site.items()
+        }
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            site_by_future = {
+                executor.submit(
+                    self.get_launch_time_outputs,
+                    launch_time,
+                    launch_inputs,
+                    sims_per_launch_time,
+                    elevation_by_site[site],
+                ): site
+                for launch_time in launch_times
+                for site, launch_inputs in launch_inputs_by_site.items()
+            }
+            try:
+                for future in as_completed(site_by_future):
+                    yield SiteEnhancedEnsembleOutputs(site=site_by_future[future], outputs=future.result())
+            finally:
+                # Don't start the remaining sweeps if the caller stopped early or one of them failed
+                for future in site_by_future:
+                    future.cancel()
 
     def refresh_data(self):
         self.data_loader.refresh_data()
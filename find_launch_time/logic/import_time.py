@@ -0,0 +1,87 @@
+"""Check that importing the package stays fast and free of side effects.
+
+Run with `python -m find_launch_time.logic.import_time`. Exits with a nonzero
+status if the import takes longer than the budget, pulls in one of the heavy
+modules which should only be loaded on first use, imports ssl before the
+simulator's monkey patching can run, or touches the filesystem.
+"""
+import json
+import subprocess
+import sys
+
+from .config import (
+    import_time_budget_seconds,
+    imported_after_simulator_modules,
+    lazily_imported_modules,
+)
+
+
+target_module = "find_launch_time.logic.find_time"
+
+
+# Runs in the fresh interpreter. The data directory is located with the same
+# expression as load_data.data_location, without importing load_data.
+probe_code = """\
+import importlib.util, json, pathlib, sys
+load_data_filepath = pathlib.Path(importlib.util.find_spec("find_launch_time.logic.load_data").origin)
+data_dir = load_data_filepath.parent.parent / "data"
+data_dir_existed = data_dir.exists()
+import {module_name}
+print(json.dumps({{
+    "imported": sorted({{name.split(".")[0] for name in sys.modules}}),
+    "created_data_dir": not data_dir_existed and data_dir.exists(),
+}}))
+"""
+
+
+def measure_import(module_name: str) -> tuple[float, dict]:
+    """Import the module in a fresh interpreter with `-X importtime`.
+
+    Return the cumulative import time in seconds, and a report with the top
+    level names of all modules which ended up imported and whether the import
+    created the data directory.
+    """
+    code = probe_code.format(module_name=module_name)
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+    )
+    if completed.returncode != 0:
+        # The traceback of the failed import is in stderr, among the import times
+        print(completed.stderr, file=sys.stderr)
+        completed.check_returncode()
+    cumulative_us = None
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = (part.strip() for part in line.removeprefix("import time:").split("|"))
+        if name == module_name:
+            cumulative_us = int(cumulative)
+    if cumulative_us is None:
+        raise RuntimeError(f"No import time reported for {module_name}")
+    report = json.loads(completed.stdout.splitlines()[-1])
+    return cumulative_us / 1e6, report
+
+
+def main() -> int:
+    seconds, report = measure_import(target_module)
+    problems = []
+    print(f"importing {target_module} took {seconds:.3f} s (budget {import_time_budget_seconds} s)")
+    if seconds > import_time_budget_seconds:
+        problems.append(f"import took {seconds:.3f} s, over budget of {import_time_budget_seconds} s")
+    eager = sorted(set(lazily_imported_modules) & set(report["imported"]))
+    if eager:
+        problems.append(f"modules imported eagerly: {eager}")
+    before_simulator = sorted(set(imported_after_simulator_modules) & set(report["imported"]))
+    if before_simulator:
+        problems.append(f"modules imported before the simulator can patch them: {before_simulator}")
+    if report["created_data_dir"]:
+        problems.append("import created the data directory")
+    for problem in problems:
+        print(problem)
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
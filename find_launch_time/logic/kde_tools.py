@@ -1,41 +1,91 @@
+from __future__ import annotations
+
+from collections.abc import Iterable
+from dataclasses import dataclass
+from functools import cached_property
+from typing import TYPE_CHECKING
+
 import geopandas as gpd
-import geoplot as gplt
-from matplotlib import pyplot as plt
-from matplotlib.axes import Axes
-from matplotlib.collections import PathCollection
-from matplotlib.path import Path
-from shapely.geometry import MultiPolygon, Polygon
+import numpy as np
+from shapely.geometry import Polygon
+
+if TYPE_CHECKING:
+    from scipy.stats import gaussian_kde
+
+
+@dataclass
+class KDEDensity:
+    """Gaussian KDE of points, evaluated once on a regular grid.
+
+    Any number of highest density regions can be extracted from the same evaluation.
+    """
+    kernel: gaussian_kde
+    grid_x: np.ndarray
+    grid_y: np.ndarray
+    # Shape (len(grid_y), len(grid_x))
+    density: np.ndarray
+    crs: object
+
+    def hdr_thresholds(self, proportions_of_distribution: Iterable[float]) -> np.ndarray:
+        """Density values whose superlevel sets contain the given proportions of the mass."""
+        # Same approach as seaborn, which geoplot.kdeplot uses for its levels
+        sorted_density = np.sort(self.density, axis=None)[::-1]
+        cumulative_mass = np.cumsum(sorted_density) / sorted_density.sum()
+        indices = np.searchsorted(cumulative_mass, np.asarray(list(proportions_of_distribution)))
+        return np.take(sorted_density, indices, mode="clip")
+
+    @cached_property
+    def _contour_generator(self):
+        from contourpy import FillType, contour_generator
+
+        return contour_generator(
+            x=self.grid_x, y=self.grid_y, z=self.density, fill_type=FillType.OuterOffset
+        )
+
+    def region_polygons(self, threshold: float) -> list[Polygon]:
+        # Upper level just above the peak so that the whole superlevel set is filled
+        upper = np.nextafter(self.density.max(), np.inf)
+        all_points, all_offsets = self._contour_generator.filled(threshold, upper)
+        polygons = []
+        for points, offsets in zip(all_points, all_offsets):
+            # First ring is the exterior, the rest are holes
+            rings = [points[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+            polygons.append(Polygon(rings[0], holes=rings[1:]))
+        return polygons
+
+    def region_gdf(self, proportion_of_distribution: float) -> gpd.GeoDataFrame:
+        """Highest density region containing the given proportion of the distribution."""
+        [threshold] = self.hdr_thresholds([proportion_of_distribution])
+        return gpd.GeoDataFrame(geometry=self.region_polygons(threshold), crs=self.crs)
+
+    def region_gdfs(self, proportions_of_distribution: Iterable[float]) -> dict[float, gpd.GeoDataFrame]:
+        """Highest density regions for each of the proportions of the distribution."""
+        proportions_of_distribution = list(proportions_of_distribution)
+        thresholds = self.hdr_thresholds(proportions_of_distribution)
+        return {
+            proportion: gpd.GeoDataFrame(geometry=self.region_polygons(threshold), crs=self.crs)
+            for proportion, threshold in zip(proportions_of_distribution, thresholds)
+        }
+
+
+def kde_density_from_points(points: gpd.GeoDataFrame, gridsize: int = 200, cut: float = 3) -> KDEDensity:
+    """Fit a Gaussian KDE to the points and evaluate it on a grid covering them.
 
+    The grid extends `cut` bandwidths past the extreme points, like in seaborn.
+    """
+    from scipy.stats import gaussian_kde
 
-def kde_ax_from_points(points: gpd.GeoDataFrame, proportion_of_distribution) -> Axes:
-    contour_level = 1 - proportion_of_distribution
-    levels = [contour_level]
-    kde_ax = gplt.kdeplot(points, levels=levels)
-    return kde_ax
+    xy = np.vstack([points.geometry.x.to_numpy(), points.geometry.y.to_numpy()])
+    kernel = gaussian_kde(xy)
+    bandwidths = np.sqrt(np.diag(kernel.covariance))
+    grid_x, grid_y = (
+        np.linspace(values.min() - cut * bw, values.max() + cut * bw, gridsize)
+        for values, bw in zip(xy, bandwidths)
+    )
+    mesh_x, mesh_y = np.meshgrid(grid_x, grid_y)
+    density = kernel(np.vstack([mesh_x.ravel(), mesh_y.ravel()])).reshape(mesh_x.shape)
+    return KDEDensity(kernel=kernel, grid_x=grid_x, grid_y=grid_y, density=density, crs=points.crs)
 
 
 def kde_gdf_from_points(points: gpd.GeoDataFrame, proportion_of_distribution: float = 0.95) -> gpd.GeoDataFrame:
-    # Adapted from https://gist.github.com/haavardaagesen/96f5566a06b83648f393d00a0aa5bd48#file-contours_to_polygons-py
-    kde_ax = kde_ax_from_points(points, proportion_of_distribution)
-
-    polygons: list[MultiPolygon] = []
-    for col in kde_ax.collections:
-        if not isinstance(col, PathCollection):
-            continue
-        # Loop through all polygons that have the same intensity level
-        for contour in col.get_paths():
-            if not isinstance(contour, Path):
-                continue
-            # Create a polygon for the countour
-            # First polygon is the main countour, the rest are holes
-            for _, poly_points in enumerate(contour.to_polygons()):
-                x = poly_points[:,0]
-                y = poly_points[:,1]
-                poly = Polygon([(i[0], i[1]) for i in zip(x,y)])
-                # Append polygon to list
-                polygons.append(poly)
-    poly_gdf = gpd.GeoDataFrame(geometry=polygons, crs=points.crs)
-    # Close the KDE window so that it doesn't show up on the next plt.show() call
-    fig = kde_ax.get_figure()
-    plt.close(fig)
-    return poly_gdf
+    return kde_density_from_points(points).region_gdf(proportion_of_distribution)
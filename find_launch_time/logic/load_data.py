@@ -1,3 +1,4 @@
+import json
 import logging
 import shutil
 import sqlite3
@@ -7,11 +8,15 @@ from zipfile import ZipFile
 
 import geopandas as gpd
 import pandas as pd
-import pyrosm
-import requests
 from shapely.geometry import Polygon, box
 
-from .config import human_crs, processing_crs, bad_landing_tags, geofabrik_osm_column_types
+from .config import (
+    human_crs,
+    processing_crs,
+    bad_landing_tags,
+    bad_landing_lod_tolerances,
+    geofabrik_osm_column_types,
+)
 
 
 logger = logging.getLogger(__name__)
@@ -21,7 +26,6 @@ logger.setLevel(logging.INFO)
 data_location = Path(__file__).parent.parent / "data"
 def init_data_dir():
     data_location.mkdir(exist_ok=True)
-init_data_dir()
 
 data_files = {
     "admin_0_countries_zip_filepath" : data_location / "ne_110m_admin_0_countries.zip",
@@ -34,6 +38,8 @@ data_files = {
     "osm_pbf": None,
     "osm_sqlite": data_location / "osm.sqlite",
     "osm_feather": data_location / "osm.feather",
+    "bad_landing_lods_feather": data_location / "bad_landing_lods.feather",
+    "bad_landing_lods_stamp": data_location / "bad_landing_lods.json",
 }
 
 data_files_needed = [
@@ -42,6 +48,12 @@ data_files_needed = [
     "seas_polygons_feather_filepath",
 ]
 
+# The bad landing levels of detail are computed from these
+bad_landing_lods_source_keys = [
+    "osm_feather",
+    "seas_polygons_feather_filepath",
+]
+
 
 def wipe_data():
     try:
@@ -148,6 +160,8 @@ def download_and_unzip_countries():
         return
     countries_110m_url = "https://naciscdn.org/naturalearth/110m/cultural/ne_110m_admin_0_countries.zip"
     countries_110m_zip_filepath = data_files["admin_0_countries_zip_filepath"]
+    # Imported on first use, see find_time.load_simulator
+    import requests
     resp = requests.get(countries_110m_url)
     resp.raise_for_status()
     with open(countries_110m_zip_filepath, 'wb') as f:
@@ -165,6 +179,8 @@ def download_unzip_and_prepare_seas_feather():
         return
     seas_url = "https://osmdata.openstreetmap.de/download/water-polygons-split-4326.zip"
     seas_zip_filepath = data_files["seas_polygons_zip_filepath"]
+    # Imported on first use, see find_time.load_simulator
+    import requests
     resp = requests.get(seas_url)
     resp.raise_for_status()
     with open(seas_zip_filepath, 'wb') as f:
@@ -202,6 +218,7 @@ def get_osm_in_feather_form():
         logger.info(f"osm feather file already exists at {data_files['osm_feather']}")
         return
     logger.info("Getting osm data in feather form")
+    import pyrosm
     osm_pbf_filepath = pyrosm.get_data("Finland", directory=data_location, update=True)
     data_files['osm_pbf'] = osm_pbf_filepath
     logger.info(f"Downloaded osm_pbf to {osm_pbf_filepath}")
@@ -216,6 +233,7 @@ def get_osm_in_feather_form():
 
 
 def download_and_prepare_data():
+    init_data_dir()
     download_and_unzip_countries()
     get_osm_in_feather_form()
     download_unzip_and_prepare_seas_feather()
@@ -259,6 +277,76 @@ def load_bad_landing_data() -> gpd.GeoSeries:
     return gpd.GeoSeries(df, crs=shared_crs)
 
 
+def lod_column(tolerance: float) -> str:
+    return f"lod_{tolerance}m"
+
+
+def make_bad_landing_lods(bad_landing_gs: gpd.GeoSeries) -> gpd.GeoDataFrame:
+    """Simplified versions of each bad landing polygon, one geometry column per tolerance,
+    and the area of the full resolution polygon."""
+    columns = {"area": bad_landing_gs.area.to_numpy()}
+    for tolerance in bad_landing_lod_tolerances:
+        columns[lod_column(tolerance)] = bad_landing_gs.simplify(tolerance, preserve_topology=True).values
+    return gpd.GeoDataFrame(columns, geometry=lod_column(bad_landing_lod_tolerances[0]), crs=bad_landing_gs.crs)
+
+
+def bad_landing_lods_source_stamp() -> dict | None:
+    """Identify the source files and tolerances the levels of detail were computed from.
+
+    None if a source file is missing.
+    """
+    sources = {}
+    for data_file_key in bad_landing_lods_source_keys:
+        filepath = data_files[data_file_key]
+        if not filepath.exists():
+            logger.debug(f"Did not find {data_file_key} at {filepath}")
+            return None
+        stat = filepath.stat()
+        sources[data_file_key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    return {"sources": sources, "tolerances": list(bad_landing_lod_tolerances)}
+
+
+def bad_landing_lods_up_to_date() -> bool:
+    lods_filepath = data_files["bad_landing_lods_feather"]
+    stamp_filepath = data_files["bad_landing_lods_stamp"]
+    if not lods_filepath.exists() or not stamp_filepath.exists():
+        return False
+    current_stamp = bad_landing_lods_source_stamp()
+    if current_stamp is None:
+        return False
+    with open(stamp_filepath) as f:
+        saved_stamp = json.load(f)
+    return saved_stamp == current_stamp
+
+
+def save_bad_landing_lods(lods: gpd.GeoDataFrame):
+    """Save the levels of detail together with a stamp of the source files they were computed from."""
+    lods_filepath = data_files["bad_landing_lods_feather"]
+    lods.to_feather(lods_filepath)
+    with open(data_files["bad_landing_lods_stamp"], "w") as f:
+        json.dump(bad_landing_lods_source_stamp(), f)
+    logger.info(f"Saved bad landing levels of detail to {lods_filepath}")
+
+
+def load_bad_landing_lods(bad_landing_gs: gpd.GeoSeries) -> gpd.GeoDataFrame:
+    """Load the levels of detail of the given bad landing polygons, or compute them from the
+    polygons and save them if the source files changed since they were saved.
+
+    The bad landing polygons need to be in processing CRS, as the tolerances are in meters.
+    """
+    lods_filepath = data_files["bad_landing_lods_feather"]
+    if bad_landing_lods_up_to_date():
+        lods = gpd.read_feather(lods_filepath)
+        if len(lods) == len(bad_landing_gs):
+            logger.info(f"Loaded bad landing levels of detail from {lods_filepath}")
+            return lods
+        logger.info(f"Bad landing levels of detail in {lods_filepath} don't match the bad landing polygons")
+    logger.info("Computing bad landing levels of detail")
+    lods = make_bad_landing_lods(bad_landing_gs)
+    save_bad_landing_lods(lods)
+    return lods
+
+
 def get_finland_gs() -> Polygon:
     if not data_ready():
         logger.info("Data not ready. Getting files now")
@@ -277,6 +365,7 @@ class DataLoader:
         if debug:
             logger.setLevel(logging.DEBUG)
         self.bad_landing_sindex_by_crs = {}
+        self.bad_landing_lod_by_tolerance = {}
         init_data_dir()
         self.load_data()
 
@@ -288,6 +377,11 @@ class DataLoader:
 
     def load_data(self):
         self.bad_landing_gs = load_bad_landing_data().to_crs(processing_crs)
+        lods = load_bad_landing_lods(self.bad_landing_gs)
+        self.bad_landing_area = lods["area"].to_numpy()
+        self.bad_landing_lod_by_tolerance = {0: self.bad_landing_gs}
+        for tolerance in bad_landing_lod_tolerances:
+            self.bad_landing_lod_by_tolerance[tolerance] = lods[lod_column(tolerance)]
         sindex_crs = {processing_crs}
         # Initialize spatial index
         for crs in sindex_crs:
@@ -299,6 +393,14 @@ class DataLoader:
             self.save_bad_landing_sindex(crs)
         return self.bad_landing_sindex_by_crs[crs]
 
+    def get_bad_landing_lod(self, max_tolerance: float) -> gpd.GeoSeries:
+        """The coarsest level of detail of the bad landing polygons within the tolerance, in processing CRS.
+
+        Rows are in the same order as in bad_landing_gs.
+        """
+        tolerance = max(tol for tol in self.bad_landing_lod_by_tolerance if tol <= max_tolerance)
+        return self.bad_landing_lod_by_tolerance[tolerance]
+
     def refresh_data(self):
         wipe_data()
         init_data_dir()
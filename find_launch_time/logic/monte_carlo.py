@@ -0,0 +1,132 @@
+"""Monte Carlo estimates of bad landing in a KDE region.
+
+Instead of intersecting the bad landing polygons with the region and summing areas,
+sample points and classify them all at once against the bad landing spatial index.
+Good for about a percent of precision at a fraction of the cost when the region
+overlaps thousands of polygons.
+
+Points uniform in the region estimate the proportion of bad landing area, the same
+quantity as the exact computation. Points drawn from the fitted density estimate the
+probability of a bad landing, a separate metric.
+"""
+from dataclasses import dataclass
+
+import geopandas as gpd
+import numpy as np
+import shapely
+from shapely.geometry.base import BaseGeometry
+
+from .config import processing_crs
+from .kde_tools import KDEDensity
+from .load_data import DataLoader
+
+
+@dataclass
+class BadLandingProportionEstimate:
+    proportion: float
+    standard_error: float
+    sample_count: int
+
+
+def sample_points_in_region(region_geometry: BaseGeometry, count: int, rng: np.random.Generator) -> np.ndarray:
+    """Uniformly distributed points in the region, as an array of shape (count, 2)."""
+    shapely.prepare(region_geometry)
+    minx, miny, maxx, maxy = region_geometry.bounds
+    fill_ratio = max(region_geometry.area / ((maxx - minx) * (maxy - miny)), 0.01)
+    batches = []
+    sampled = 0
+    while sampled < count:
+        # Draw enough for the rest in one go, most of the time
+        batch_size = int((count - sampled) / fill_ratio * 1.1) + 16
+        x = rng.uniform(minx, maxx, batch_size)
+        y = rng.uniform(miny, maxy, batch_size)
+        inside = shapely.contains_xy(region_geometry, x, y)
+        batches.append(np.column_stack([x[inside], y[inside]]))
+        sampled += np.count_nonzero(inside)
+    return np.concatenate(batches)[:count]
+
+
+def sample_points_from_density(
+    kde_density: KDEDensity,
+    region_geometry: BaseGeometry,
+    count: int,
+    rng: np.random.Generator,
+) -> np.ndarray:
+    """Points drawn from the fitted density and falling in the region, as an array of shape (count, 2).
+
+    The region is in processing CRS, the returned points are too.
+    """
+    shapely.prepare(region_geometry)
+    batches = []
+    sampled = 0
+    while sampled < count:
+        batch_size = int((count - sampled) * 1.1) + 16
+        drawn = kde_density.kernel.resample(batch_size, seed=rng)
+        drawn = gpd.GeoSeries(gpd.points_from_xy(drawn[0], drawn[1]), crs=kde_density.crs).to_crs(processing_crs)
+        x, y = drawn.x.to_numpy(), drawn.y.to_numpy()
+        inside = shapely.contains_xy(region_geometry, x, y)
+        batches.append(np.column_stack([x[inside], y[inside]]))
+        sampled += np.count_nonzero(inside)
+    return np.concatenate(batches)[:count]
+
+
+def proportion_of_points_on_bad_landing(
+    points_xy: np.ndarray,
+    data_loader: DataLoader,
+    count_overlaps: bool,
+) -> BadLandingProportionEstimate:
+    """Classify the points against the bad landing spatial index in bulk.
+
+    With count_overlaps, a point in several overlapping bad landing polygons counts once for
+    each of them, otherwise once in total.
+    """
+    bad_landing_sindex = data_loader.get_bad_landing_sindex(processing_crs)
+    points = shapely.points(points_xy)
+    input_indices, _ = bad_landing_sindex.query(points, predicate="intersects")
+    count = len(points_xy)
+    hits_per_point = np.bincount(input_indices, minlength=count)
+    if not count_overlaps:
+        hits_per_point = np.minimum(hits_per_point, 1)
+    proportion = hits_per_point.mean()
+    standard_error = hits_per_point.std() / np.sqrt(count)
+    return BadLandingProportionEstimate(proportion=proportion, standard_error=standard_error, sample_count=count)
+
+
+def estimate_proportion_of_bad_landing(
+    region_geometry: BaseGeometry,
+    data_loader: DataLoader,
+    sample_count: int,
+    rng: np.random.Generator | None = None,
+) -> BadLandingProportionEstimate:
+    """Estimate the proportion of bad landing area to region area from points uniform in the region.
+
+    Measures the same as the exact computation: the areas of the bad landing polygons within
+    the region are summed, so where polygons overlap, the overlap counts once for each polygon.
+    """
+    if region_geometry.is_empty:
+        raise ValueError("Can't sample from an empty region")
+    if rng is None:
+        rng = np.random.default_rng()
+    points_xy = sample_points_in_region(region_geometry, sample_count, rng)
+    return proportion_of_points_on_bad_landing(points_xy, data_loader, count_overlaps=True)
+
+
+def estimate_probability_of_bad_landing(
+    region_geometry: BaseGeometry,
+    kde_density: KDEDensity,
+    data_loader: DataLoader,
+    sample_count: int,
+    rng: np.random.Generator | None = None,
+) -> BadLandingProportionEstimate:
+    """Estimate the probability of a bad landing, given that the landing is in the region,
+    from points drawn from the fitted density.
+
+    This is a different metric from the proportion of bad landing area, and has no exact counterpart
+    here. Overlapping bad landing polygons count once.
+    """
+    if region_geometry.is_empty:
+        raise ValueError("Can't sample from an empty region")
+    if rng is None:
+        rng = np.random.default_rng()
+    points_xy = sample_points_from_density(kde_density, region_geometry, sample_count, rng)
+    return proportion_of_points_on_bad_landing(points_xy, data_loader, count_overlaps=False)
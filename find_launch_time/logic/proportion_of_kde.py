@@ -1,63 +1,248 @@
 import dataclasses
+from collections.abc import Iterable
 from datetime import datetime
 from pprint import pprint
 import geopandas as gpd
+import numpy as np
+import shapely
 from dataclasses import dataclass
+from shapely.geometry.base import BaseGeometry
 
-from .config import processing_crs, human_crs
-from .kde_tools import kde_gdf_from_points
+from .config import (
+    processing_crs,
+    human_crs,
+    kde_proportions_of_distribution,
+    bad_landing_proportion_mode,
+    bad_landing_lod_tolerance_to_kde_size,
+    max_bad_landing_proportion,
+    monte_carlo_fallback_standard_errors,
+    monte_carlo_sample_count,
+    estimate_bad_landing_probability,
+)
+from .kde_tools import kde_density_from_points
 from .load_data import DataLoader
+from .monte_carlo import estimate_probability_of_bad_landing, estimate_proportion_of_bad_landing
 from .utils import get_single_geometry, poly_in_crs
 
 
+def geojson_ready(value):
+    """Use GeoJSON format for the geometries, also inside nested dicts and lists."""
+    if isinstance(value, gpd.GeoDataFrame):
+        return value.to_json()
+    if isinstance(value, dict):
+        return {key: geojson_ready(val) for key, val in value.items()}
+    if isinstance(value, list):
+        return [geojson_ready(val) for val in value]
+    return value
+
+
+@dataclass
+class KDELevelOutputs:
+    """One highest density region of the KDE, compared with the bad landing polygons."""
+    proportion_of_distribution: float
+    bad_landing_areas: gpd.GeoDataFrame | None
+    kde: gpd.GeoDataFrame
+    proportion_of_bad_landing_to_kde: float
+    # Zero when the proportion was computed exactly
+    proportion_of_bad_landing_standard_error: float = 0.0
+    # Probability of a bad landing given a landing in the KDE, only when estimated
+    probability_of_bad_landing: float | None = None
+    probability_of_bad_landing_standard_error: float | None = None
+
+
 @dataclass
 class EnhancedEnsembleOutputs:
-    """The outputs of the sims, enhanced by KDE computation and comparison with bad landing polygons."""
+    """The outputs of the sims, enhanced by KDE computation and comparison with bad landing polygons.
+
+    The top level KDE fields describe the outermost level, the region containing the largest
+    proportion of the distribution. All levels, outermost first, are in `levels`.
+    When the proportion of bad landing was estimated by Monte Carlo, `bad_landing_areas`
+    holds the bad landing polygons intersecting the KDE without clipping them to it.
+    """
     launch_time: datetime
     bad_landing_areas: gpd.GeoDataFrame | None
     predicted_landing_sites: gpd.GeoDataFrame
     kde: gpd.GeoDataFrame
     proportion_of_bad_landing_to_kde: float
+    levels: list[KDELevelOutputs]
+    proportion_of_bad_landing_standard_error: float = 0.0
+    probability_of_bad_landing: float | None = None
+    probability_of_bad_landing_standard_error: float | None = None
 
     def to_dict(self):
         naive_dict = dataclasses.asdict(self)
-        # Use GeoJSON format for the geometries
-        final_format_dict = {}
-        for key, value in naive_dict.items():
-            if isinstance(value, gpd.GeoDataFrame):
-                final_format_dict[key] = value.to_json()
-            else:
-                final_format_dict[key] = value
-        return final_format_dict
+        return geojson_ready(naive_dict)
+
 
+def kde_geometries_in_processing_crs(kde_by_level: dict[float, gpd.GeoDataFrame]) -> dict[float, BaseGeometry]:
+    kde_geometries = {
+        level: get_single_geometry(kde_poly_gs, out_crs=processing_crs)
+        for level, kde_poly_gs in kde_by_level.items()
+    }
+    # Prepared once, every predicate against the KDE reuses the preparation
+    for kde_geometry in kde_geometries.values():
+        shapely.prepare(kde_geometry)
+    return kde_geometries
 
-def bad_landing_intersecting_with_kde(kde_poly_gs, data_loader: DataLoader):
+
+def bad_landing_lod_for_kde(kde_geometry: BaseGeometry, data_loader: DataLoader) -> np.ndarray:
+    """The bad landing polygons at a level of detail suited to the size of the KDE, as a shapely array."""
+    max_tolerance = bad_landing_lod_tolerance_to_kde_size * np.sqrt(kde_geometry.area)
+    return data_loader.get_bad_landing_lod(max_tolerance).to_numpy()
+
+
+def bad_landing_candidates_for_kde_levels(
+    kde_geometries: dict[float, BaseGeometry],
+    data_loader: DataLoader,
+) -> dict[float, np.ndarray | None]:
+    """Find the positions of the bad landing polygons intersecting each KDE level.
+
+    Highest density regions are nested, so the spatial index is queried only once,
+    with the outermost level. The candidates are then narrowed down for the inner levels.
+    """
     kde_simplify_tolerance = 10  # meters
-    kde_geometry = get_single_geometry(kde_poly_gs, out_crs=processing_crs)
-    simplified_kde_geometry = kde_geometry.simplify(kde_simplify_tolerance)
-    # print(f"number of vertices: {len(kde_geometry.exterior.coords)}")
-    # bad_landing_geometry = get_single_geometry(bad_landing_gs, out_crs=shared_crs)
-    # print(f"bad landing geometry bounds: {poly_in_crs(bad_landing_geometry, shared_crs, human_crs).bounds}")
-    # print(f"kde geometry bounds: {poly_in_crs(simplified_kde_geometry, processing_crs, human_crs).bounds}")
+    outermost_level = max(kde_geometries)
+    simplified_outermost_kde_geometry = kde_geometries[outermost_level].simplify(kde_simplify_tolerance)
     bad_landing_sindex = data_loader.get_bad_landing_sindex(processing_crs)
-    intersecting = bad_landing_sindex.query(simplified_kde_geometry, predicate="intersects")
+    intersecting = bad_landing_sindex.query(simplified_outermost_kde_geometry, predicate="intersects")
     if not intersecting.size:
-        return None
-    intersection_gs = data_loader.bad_landing_gs.to_crs(processing_crs).iloc[intersecting].intersection(kde_geometry)
-    return intersection_gs
+        return {level: None for level in kde_geometries}
+    intersecting_geometries = data_loader.bad_landing_gs.to_numpy()[intersecting]
+    candidates_by_level = {}
+    for level, kde_geometry in kde_geometries.items():
+        if level == outermost_level:
+            level_candidates = intersecting
+        else:
+            # The KDE geometry is prepared, so testing against it at full resolution is cheap,
+            # and no polygon touching the inner level is lost to simplification
+            level_candidates = intersecting[shapely.intersects(kde_geometry, intersecting_geometries)]
+        candidates_by_level[level] = level_candidates if level_candidates.size else None
+    return candidates_by_level
+
 
+def bad_landing_in_kde_level(
+    kde_geometry: BaseGeometry,
+    candidates: np.ndarray,
+    data_loader: DataLoader,
+) -> tuple[gpd.GeoSeries, float]:
+    """Clip the candidate bad landing polygons to the KDE, and sum their area within it.
 
-def get_enhanced_ensemble_outputs(launch_time: datetime, points_gdf, data_loader: DataLoader) -> EnhancedEnsembleOutputs:
+    Candidates which the KDE covers entirely, tested at full resolution, are kept as they are
+    and use their precomputed full resolution area. Only the ones crossing the KDE boundary
+    are intersected with it, using the level of detail suited to the KDE's size, so those
+    returned geometries and their areas are from simplified polygons.
+    """
+    full_resolution_geometries = data_loader.bad_landing_gs.to_numpy()[candidates]
+    covered = shapely.covers(kde_geometry, full_resolution_geometries)
+    crossing_boundary = ~covered
+    simplified_crossing = bad_landing_lod_for_kde(kde_geometry, data_loader)[candidates[crossing_boundary]]
+    clipped = full_resolution_geometries.copy()
+    clipped[crossing_boundary] = shapely.intersection(simplified_crossing, kde_geometry)
+    area = (data_loader.bad_landing_area[candidates[covered]].sum()
+            + shapely.area(clipped[crossing_boundary]).sum())
+    clipped_gs = gpd.GeoSeries(clipped, index=data_loader.bad_landing_gs.index[candidates], crs=processing_crs)
+    return clipped_gs, area
+
+
+def get_enhanced_ensemble_outputs(
+    launch_time: datetime,
+    points_gdf,
+    data_loader: DataLoader,
+    proportions_of_distribution: Iterable[float] = kde_proportions_of_distribution,
+    bad_landing_proportion_mode: str = bad_landing_proportion_mode,
+    estimate_bad_landing_probability: bool = estimate_bad_landing_probability,
+    rng: np.random.Generator | None = None,
+) -> EnhancedEnsembleOutputs:
     """Generate a Kernel Density Estimate (KDE) from the estimated landing location points,
-    and compare it with the bad landing polygons. Return the whole package of outputs,
-    including the points passed to this function, their KDE, the proportion of bad landing area to KDE area,
-    and the bad landing polys within the KDE.
+    and compare each requested highest density region of it with the bad landing polygons.
+    The density is evaluated once for all of the regions.
+    Return the whole package of outputs, including the points passed to this function,
+    the KDE regions, the proportion of bad landing area to KDE area, and the bad landing polys
+    within the KDE for each region.
+
+    With bad_landing_proportion_mode 'monte_carlo' the proportion is estimated from points
+    sampled uniformly in the KDE, see monte_carlo.py, and computed exactly only when the estimate
+    is too close to max_bad_landing_proportion to tell which side it is on. Both measure the same
+    quantity, so the proportion means the same whichever way it was computed.
+
+    With estimate_bad_landing_probability, the probability of a bad landing given a landing in
+    the KDE is also estimated by sampling from the fitted density, and reported separately.
     """
+    if bad_landing_proportion_mode not in ('exact', 'monte_carlo'):
+        raise ValueError(
+            f"Unknown bad_landing_proportion_mode '{bad_landing_proportion_mode}', expected 'exact' or 'monte_carlo'"
+        )
+    proportions_of_distribution = sorted(set(proportions_of_distribution), reverse=True)
+    if not proportions_of_distribution:
+        raise ValueError("At least one proportion of distribution is needed")
+    out_of_range = [proportion for proportion in proportions_of_distribution if not 0 < proportion <= 1]
+    if out_of_range:
+        raise ValueError(f"Proportions of distribution must be in (0, 1], got {out_of_range}")
     shared_crs = processing_crs
-    kde = kde_gdf_from_points(points_gdf).to_crs(shared_crs)
-    bad_landing_in_kde = bad_landing_intersecting_with_kde(kde, data_loader)
-    proportion_of_bad_landing_to_whole = (bad_landing_in_kde.to_crs(shared_crs).area.sum() / kde.area.sum()
-                                         if bad_landing_in_kde is not None else 0)
+    kde_density = kde_density_from_points(points_gdf)
+    kde_by_level = {
+        proportion: kde.to_crs(shared_crs)
+        for proportion, kde in kde_density.region_gdfs(proportions_of_distribution).items()
+    }
+    kde_geometries = kde_geometries_in_processing_crs(kde_by_level)
+    candidates_by_level = bad_landing_candidates_for_kde_levels(kde_geometries, data_loader)
+    levels = []
+    for proportion in proportions_of_distribution:
+        kde = kde_by_level[proportion]
+        candidates = candidates_by_level[proportion]
+        standard_error = 0.0
+        bad_landing_in_kde = None
+        probability = probability_standard_error = 0.0 if estimate_bad_landing_probability else None
+        if candidates is None:
+            proportion_of_bad_landing_to_whole = 0
+        else:
+            if estimate_bad_landing_probability:
+                probability_estimate = estimate_probability_of_bad_landing(
+                    kde_geometries[proportion],
+                    kde_density,
+                    data_loader,
+                    sample_count=monte_carlo_sample_count,
+                    rng=rng,
+                )
+                probability = probability_estimate.proportion
+                probability_standard_error = probability_estimate.standard_error
+            exact = bad_landing_proportion_mode == 'exact'
+            if not exact:
+                estimate = estimate_proportion_of_bad_landing(
+                    kde_geometries[proportion],
+                    data_loader,
+                    sample_count=monte_carlo_sample_count,
+                    rng=rng,
+                )
+                margin = monte_carlo_fallback_standard_errors * estimate.standard_error
+                # Too close to call, fall back to the exact computation
+                exact = abs(estimate.proportion - max_bad_landing_proportion) <= margin
+            if exact:
+                bad_landing_in_kde, bad_landing_area = bad_landing_in_kde_level(
+                    kde_geometries[proportion], candidates, data_loader
+                )
+                proportion_of_bad_landing_to_whole = bad_landing_area / kde.area.sum()
+            else:
+                # Not clipped to the KDE, the intersection is what the estimate avoids computing
+                bad_landing_in_kde = data_loader.bad_landing_gs.iloc[candidates]
+                proportion_of_bad_landing_to_whole = estimate.proportion
+                standard_error = estimate.standard_error
+        if (not isinstance(bad_landing_in_kde, (gpd.GeoDataFrame, gpd.GeoSeries, type(None)))
+            or not isinstance(kde, (gpd.GeoDataFrame, gpd.GeoSeries))):
+            error_string = f"""\
+                bad_landing_in_kde and kde_gdf type requirements not met,
+                got {type(bad_landing_in_kde)} and {type(kde)}
+            """
+            raise ValueError(error_string)
+        levels.append(KDELevelOutputs(
+            proportion_of_distribution=proportion,
+            bad_landing_areas=bad_landing_in_kde,
+            kde=kde,
+            proportion_of_bad_landing_to_kde=proportion_of_bad_landing_to_whole,
+            proportion_of_bad_landing_standard_error=standard_error,
+            probability_of_bad_landing=probability,
+            probability_of_bad_landing_standard_error=probability_standard_error,
+        ))
     """
     plot_kde_and_bad_landing_polys(
         kde_gdf,
@@ -66,18 +251,16 @@ def get_enhanced_ensemble_outputs(launch_time: datetime, points_gdf, data_loader
         points=points_gdf
     )
     """
-    if (not isinstance(bad_landing_in_kde, (gpd.GeoDataFrame, gpd.GeoSeries, type(None)))
-        or not isinstance(kde, (gpd.GeoDataFrame, gpd.GeoSeries))):
-        error_string = f"""\
-            bad_landing_in_kde and kde_gdf type requirements not met,
-            got {type(bad_landing_in_kde)} and {type(kde)}
-        """
-        raise ValueError(error_string)
+    outermost = levels[0]
     enhanced_outputs = EnhancedEnsembleOutputs(
         launch_time=launch_time,
-        bad_landing_areas=bad_landing_in_kde,
+        bad_landing_areas=outermost.bad_landing_areas,
         predicted_landing_sites=points_gdf,
-        kde=kde,
-        proportion_of_bad_landing_to_kde=proportion_of_bad_landing_to_whole
+        kde=outermost.kde,
+        proportion_of_bad_landing_to_kde=outermost.proportion_of_bad_landing_to_kde,
+        levels=levels,
+        proportion_of_bad_landing_standard_error=outermost.proportion_of_bad_landing_standard_error,
+        probability_of_bad_landing=outermost.probability_of_bad_landing,
+        probability_of_bad_landing_standard_error=outermost.probability_of_bad_landing_standard_error,
     )
     return enhanced_outputs
@@ -65,6 +65,8 @@ def main():
         )
         proportion_of_bad_landing = outputs.proportion_of_bad_landing_to_kde
         print(f"proportion of bad landing: {proportion_of_bad_landing}")
+        for level in outputs.levels:
+            print(f"  in {level.proportion_of_distribution:.0%} region: {level.proportion_of_bad_landing_to_kde}")
         pprint({key: str(val)[:50] for key, val in outputs.to_dict().items()})
 
 if __name__ == '__main__':
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from find_launch_time.logic.kde_tools import KDEDensity
+
+
+def gaussian_kde_density(gridsize: int = 200) -> KDEDensity:
+    grid_x = np.linspace(-5, 5, gridsize)
+    grid_y = np.linspace(-4, 6, gridsize)
+    mesh_x, mesh_y = np.meshgrid(grid_x, grid_y)
+    # Correlated bivariate normal, centered at (0, 1)
+    cov = np.array([[1.0, 0.6], [0.6, 1.5]])
+    offsets = np.stack([mesh_x, mesh_y - 1], axis=-1)
+    mahalanobis = np.einsum("...i,ij,...j->...", offsets, np.linalg.inv(cov), offsets)
+    density = np.exp(-0.5 * mahalanobis) / (2 * np.pi * np.sqrt(np.linalg.det(cov)))
+    return KDEDensity(kernel=None, grid_x=grid_x, grid_y=grid_y, density=density, crs=None)
+
+
+proportions = [0.5, 0.8, 0.95]
+
+
+def test_hdr_thresholds_contain_proportions_of_mass():
+    kde_density = gaussian_kde_density()
+    thresholds = kde_density.hdr_thresholds(proportions)
+    total_mass = kde_density.density.sum()
+    for proportion, threshold in zip(proportions, thresholds):
+        mass_above = kde_density.density[kde_density.density >= threshold].sum() / total_mass
+        assert mass_above == pytest.approx(proportion, abs=1e-3)
+    # Larger proportions of the distribution need lower thresholds
+    assert np.all(np.diff(thresholds) < 0)
+
+
+def test_hdr_thresholds_match_bivariate_normal():
+    # For a bivariate normal, the highest density region containing p of the mass
+    # is bounded by the density value pdf_max * (1 - p)
+    kde_density = gaussian_kde_density(gridsize=400)
+    thresholds = kde_density.hdr_thresholds(proportions)
+    expected = kde_density.density.max() * (1 - np.asarray(proportions))
+    np.testing.assert_allclose(thresholds, expected, rtol=0.03)
+
+
+def test_hdr_thresholds_match_seaborn_levels():
+    seaborn_distributions = pytest.importorskip("seaborn.distributions")
+    kde_density = gaussian_kde_density()
+    # seaborn takes iso-proportions, the mass below the contour
+    iso_proportions = 1 - np.asarray(proportions)
+    seaborn_levels = seaborn_distributions._DistributionPlotter._quantile_to_level(
+        None, kde_density.density, iso_proportions
+    )
+    np.testing.assert_allclose(kde_density.hdr_thresholds(proportions), seaborn_levels)
@@ -0,0 +1,64 @@
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely
+from shapely.geometry import box
+
+from find_launch_time.logic.config import processing_crs
+from find_launch_time.logic.load_data import DataLoader
+from find_launch_time.logic.monte_carlo import estimate_proportion_of_bad_landing
+from find_launch_time.logic.proportion_of_kde import bad_landing_in_kde_level
+
+
+def make_data_loader(polygons) -> DataLoader:
+    """DataLoader holding the given bad landing polygons, without loading any data."""
+    data_loader = DataLoader.__new__(DataLoader)
+    data_loader.bad_landing_gs = gpd.GeoSeries(polygons, crs=processing_crs)
+    data_loader.bad_landing_area = data_loader.bad_landing_gs.area.to_numpy()
+    data_loader.bad_landing_lod_by_tolerance = {0: data_loader.bad_landing_gs}
+    data_loader.bad_landing_sindex_by_crs = {}
+    return data_loader
+
+
+kde_geometry = box(0, 0, 1000, 1000)
+bad_landing_polygons = [
+    # Inside the KDE
+    box(100, 100, 400, 400),
+    # Inside the KDE and the polygon above, like a building in residential landuse
+    box(200, 200, 300, 300),
+    # Crossing the KDE boundary
+    box(900, 900, 1100, 1100),
+    # Outside the KDE
+    box(2000, 2000, 2100, 2100),
+]
+
+
+def exact_proportion(data_loader: DataLoader) -> float:
+    candidates = data_loader.get_bad_landing_sindex(processing_crs).query(kde_geometry, predicate="intersects")
+    shapely.prepare(kde_geometry)
+    _, area = bad_landing_in_kde_level(kde_geometry, candidates, data_loader)
+    return area / kde_geometry.area
+
+
+def test_exact_proportion_sums_overlapping_areas():
+    data_loader = make_data_loader(bad_landing_polygons)
+    assert exact_proportion(data_loader) == pytest.approx((300**2 + 100**2 + 100**2) / 1000**2)
+
+
+def test_monte_carlo_estimate_agrees_with_exact():
+    data_loader = make_data_loader(bad_landing_polygons)
+    estimate = estimate_proportion_of_bad_landing(
+        kde_geometry, data_loader, sample_count=20_000, rng=np.random.default_rng(0)
+    )
+    assert estimate.sample_count == 20_000
+    assert estimate.standard_error > 0
+    assert abs(estimate.proportion - exact_proportion(data_loader)) <= 4 * estimate.standard_error
+
+
+def test_monte_carlo_estimate_without_bad_landing():
+    data_loader = make_data_loader([box(2000, 2000, 2100, 2100)])
+    estimate = estimate_proportion_of_bad_landing(
+        kde_geometry, data_loader, sample_count=1_000, rng=np.random.default_rng(0)
+    )
+    assert estimate.proportion == 0
+    assert estimate.standard_error == 0
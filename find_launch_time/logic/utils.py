@@ -1,6 +1,4 @@
 import geopandas as gpd
-from matplotlib import pyplot as plt
-
 from shapely import geometry
 
 from .config import max_bad_landing_proportion, human_crs
@@ -19,6 +17,7 @@ def poly_in_crs(poly, in_crs, out_crs):
 
 
 def plot_kde_and_bad_landing_polys(kde_poly_gs, bad_landing_gs, proportion_of_bad_landing_to_kde, points=None):
+    from matplotlib import pyplot as plt
     plotting_crs = human_crs
     kde_poly_gs = kde_poly_gs.to_crs(plotting_crs)
     if bad_landing_gs is not None: